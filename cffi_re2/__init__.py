@@ -1,25 +1,32 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
-import imp
-from cffi import FFI
-import os
-import re
 import sys
-import six
-import sre_compile
-
-# Flags, copied from re.py
-I = IGNORECASE = sre_compile.SRE_FLAG_IGNORECASE # ignore case
-L = LOCALE = sre_compile.SRE_FLAG_LOCALE # assume current 8-bit locale
-U = UNICODE = sre_compile.SRE_FLAG_UNICODE # assume unicode locale
-M = MULTILINE = sre_compile.SRE_FLAG_MULTILINE # make anchors look for newline
-S = DOTALL = sre_compile.SRE_FLAG_DOTALL # make dot match newline
-X = VERBOSE = sre_compile.SRE_FLAG_VERBOSE # ignore whitespace and comments
-
-
-ffi = FFI()
+try:
+    from _thread import allocate_lock
+except ImportError:  # Python 2
+    from thread import allocate_lock
+
+# Flags, copied from re.py. Plain constants so importing
+# cffi_re2 does not need to import sre_compile
+I = IGNORECASE = 2 # ignore case
+L = LOCALE = 4 # assume current 8-bit locale
+U = UNICODE = 32 # assume unicode locale
+M = MULTILINE = 8 # make anchors look for newline
+S = DOTALL = 16 # make dot match newline
+X = VERBOSE = 64 # ignore whitespace and comments
+
+try:
+    text_type = unicode
+except NameError:  # Python 3
+    text_type = str
+
+# FFI instance and native library. Both are loaded lazily
+# by _load_libre2() to keep "import cffi_re2" cheap
+ffi = None
 libre2 = None
-ffi.cdef('''
+_load_lock = allocate_lock()
+
+_CDEF = '''
 typedef struct {
     int start;
     int end;
@@ -37,30 +44,82 @@ typedef struct {
     Range** ranges;
 } REMultiMatchResult;
 
+typedef struct {
+    int encoding;
+    bool posixSyntax;
+    bool longestMatch;
+    bool literal;
+    bool neverNl;
+    bool dotNl;
+    bool neverCapture;
+    bool caseSensitive;
+    bool perlClasses;
+    bool wordBoundary;
+    bool oneLine;
+    int64_t maxMem;
+} REOptions;
+
 void FreeREMatchResult(REMatchResult mr);
 void FreeREMultiMatchResult(REMultiMatchResult mr);
 
-void* RE2_new(const char* pattern, bool caseInsensitive);
-REMatchResult FindSingleMatch(void* re_obj, const char* data, bool fullMatch, int startpos);
-REMultiMatchResult FindAllMatches(void* re_obj, const char* data, int anchorArg, int startpos);
+void* RE2_new(const char* pattern, const REOptions* opts);
+REMatchResult FindSingleMatch(void* re_obj, const char* data, int len, const int* lut,
+                              bool bytePositions, bool fullMatch, int startidx, int endidx,
+                              int charBase);
+REMultiMatchResult FindAllMatches(void* re_obj, const char* data, int len, const int* lut,
+                                  bool bytePositions, int anchorArg, int startidx, int endidx,
+                                  int charBase);
+int FindSingleMatchInto(void* re_obj, const char* data, int len, const int* lut,
+                        bool bytePositions, bool fullMatch, int startidx, int endidx,
+                        int charBase, Range* out, int outSize);
+int FindAllMatchesInto(void* re_obj, const char* data, int len, const int* lut,
+                       bool bytePositions, int anchorArg, int startidx, int endidx,
+                       int charBase, Range* out, int outSize);
+int CopyLastMatches(Range* out, int outSize);
+int GetScratchAllocations();
+int NumCapturingGroups(void* re_obj);
+int* BuildIndexLUT(const char* data, int len, bool latin1);
+void FreeIndexLUT(int* lut);
+int* BuildCharOffsetTable(const char* data, int len, int numChars);
+void FreeCharOffsetTable(int* table);
 void RE2_delete(void* re_obj);
 void RE2_delete_string_ptr(void* ptr);
 void* RE2_GlobalReplace(void* re_obj, const char* str, const char* rewrite);
 const char* get_c_str(void* ptr_str);
+int get_str_size(void* ptr_str);
+bool RE2_PossibleMatchRange(void* re_obj, void** min, void** max, int maxlen);
 const char* get_error_msg(void* re_obj);
 bool ok(void* re_obj);
-void RE2_SetMaxMemory(int maxmem);
-''')
-
-# Open native library
-if sys.version_info >= (3, 4):
-    import importlib
-    soname = importlib.util.find_spec("cffi_re2._cre2").origin
-else:
-    curmodpath = sys.modules[__name__].__path__
-    soname = imp.find_module('_cre2', curmodpath)[1]
-
-libre2 = ffi.dlopen(soname)
+void RE2_SetMaxMemory(int64_t maxmem);
+'''
+
+def _find_native_library():
+    """Find the filename of the _cre2 native library"""
+    if sys.version_info >= (3, 4):
+        import importlib.util
+        return importlib.util.find_spec("cffi_re2._cre2").origin
+    else:
+        import imp
+        curmodpath = sys.modules[__name__].__path__
+        return imp.find_module('_cre2', curmodpath)[1]
+
+def _load_libre2():
+    """
+    Parse the cdef and open the native library on first use.
+    Returns the library object.
+    """
+    global ffi, libre2
+    if libre2 is not None:
+        return libre2
+    with _load_lock:
+        if libre2 is None:
+            from cffi import FFI
+            new_ffi = FFI()
+            new_ffi.cdef(_CDEF)
+            lib = new_ffi.dlopen(_find_native_library())
+            ffi = new_ffi
+            libre2 = lib
+    return libre2
 
 class MatchObject(object):
     def __init__(self, re, string, ranges):
@@ -93,18 +152,149 @@ class MatchObject(object):
     def __str__(self):
         return "MatchObject(groups={0})".format(self.groups())
 
-RE_COM = re.compile('\(\?\#.*?\)')
+class Options(object):
+    """
+    Compilation options, mirroring RE2::Options.
+    See re2/re2.h for the exact semantics of every option.
+
+    Capture-free (never_capture) and literal patterns allow RE2 to use
+    faster matching engines. never_nl prevents matches from spanning
+    multiple lines.
+    """
+    ENCODING_UTF8 = "utf-8"
+    ENCODING_LATIN1 = "latin-1"
+
+    def __init__(self, encoding=ENCODING_UTF8, posix_syntax=False,
+                 longest_match=False, literal=False, never_nl=False,
+                 dot_nl=False, never_capture=False, case_sensitive=True,
+                 perl_classes=False, word_boundary=False, one_line=False,
+                 max_mem=0):
+        """
+        max_mem <= 0 selects the global budget (see set_max_memory_budget()).
+        """
+        if encoding not in (Options.ENCODING_UTF8, Options.ENCODING_LATIN1):
+            raise ValueError("Unsupported encoding: {0}".format(encoding))
+        self.encoding = encoding
+        self.posix_syntax = posix_syntax
+        self.longest_match = longest_match
+        self.literal = literal
+        self.never_nl = never_nl
+        self.dot_nl = dot_nl
+        self.never_capture = never_capture
+        self.case_sensitive = case_sensitive
+        self.perl_classes = perl_classes
+        self.word_boundary = word_boundary
+        self.one_line = one_line
+        self.max_mem = max_mem
+
+    def _to_cdata(self, flags=0):
+        """Build a REOptions struct, applying the re-compatible flags"""
+        opts = ffi.new("REOptions*")
+        opts.encoding = 1 if self.encoding == Options.ENCODING_LATIN1 else 0
+        opts.posixSyntax = self.posix_syntax
+        opts.longestMatch = self.longest_match
+        opts.literal = self.literal
+        opts.neverNl = self.never_nl
+        opts.dotNl = self.dot_nl
+        opts.neverCapture = self.never_capture
+        opts.caseSensitive = self.case_sensitive and (flags & I == 0)
+        opts.perlClasses = self.perl_classes
+        opts.wordBoundary = self.word_boundary
+        opts.oneLine = self.one_line
+        opts.maxMem = self.max_mem
+        return opts
+
+class PreparedText(object):
+    """
+    A text that is encoded once and can be passed to any CRE2 method
+    in place of a string. The index tables that map byte offsets to
+    character indices and vice versa are built on first use and kept
+    in native memory, so pos/endpos windows cost nothing extra.
+    Use this when matching many regexes against the same text.
+    """
+    def __init__(self, string, encoding=Options.ENCODING_UTF8):
+        if encoding not in (Options.ENCODING_UTF8, Options.ENCODING_LATIN1):
+            raise ValueError("Unsupported encoding: {0}".format(encoding))
+        self.string = string
+        self.encoding = encoding
+        if isinstance(string, text_type):
+            self.data = string.encode(encoding)
+        else:
+            self.data = string
+        self._lut = None
+        self._offsets = None
+
+    def _byte_offset(self, pos):
+        """Get the byte offset of the character index pos (0 <= pos <= len(string))"""
+        if self.encoding == Options.ENCODING_LATIN1 or pos == 0:
+            return pos
+        if pos == len(self.string):
+            return len(self.data)
+        if self._offsets is None:
+            lib = _load_libre2()
+            self._offsets = ffi.gc(lib.BuildCharOffsetTable(self.data, len(self.data), len(self.string)),
+                                   lib.FreeCharOffsetTable)
+        return self._offsets[pos]
+
+    def _index_lut(self):
+        """
+        Get the native index LUT, building it if necessary.
+        Latin1 texts need no LUT (NULL), as every byte is one character.
+        """
+        if self._lut is None:
+            lib = _load_libre2()
+            if self.encoding == Options.ENCODING_LATIN1:
+                self._lut = ffi.NULL
+            else:
+                self._lut = ffi.gc(lib.BuildIndexLUT(self.data, len(self.data), False),
+                                   lib.FreeIndexLUT)
+        return self._lut
+
+
+class MatchBuffer(object):
+    """
+    Preallocated buffer for match results, which can be passed to the
+    search, match, findall and finditer methods of CRE2 to avoid
+    allocating result memory on every call.
+    The buffer grows automatically if a call needs more space.
+    A buffer must not be used by multiple threads at the same time.
+    """
+    def __init__(self, size=64):
+        """size is the initial capacity in ranges (one per group and match)"""
+        if size < 1:
+            raise ValueError("MatchBuffer size must be at least 1, got {0}".format(size))
+        self.size = 0
+        self._ranges = None
+        self._ensure(size)
+
+    def _ensure(self, size):
+        """Grow the buffer to at least size ranges and return it"""
+        if size > self.size:
+            _load_libre2()
+            self._ranges = ffi.new("Range[]", size)
+            self.size = size
+        return self._ranges
 
 
 class CRE2:
-    def __init__(self, pattern, flags=0, *args, **kwargs):
-        pattern = CRE2.__convertToBinaryUTF8(pattern)
+    def __init__(self, pattern, flags=0, options=None, *args, **kwargs):
+        """
+        Compile pattern. options is an optional Options instance
+        that is passed through to RE2.
+        """
+        _load_libre2()
+        if options is None:
+            options = Options()
+        self.options = options
+        self.encoding = options.encoding
+        pattern = CRE2.__convertToBinary(pattern, self.encoding)
         self.pattern = pattern
 
         if 'compat_comment' in kwargs:
-            pattern = RE_COM.sub('', pattern)
+            import re
+            pattern = re.sub(br'\(\?\#.*?\)', b'', pattern)
 
-        self.re2_obj = ffi.gc(libre2.RE2_new(pattern, flags & I != 0),
+        self.re2_obj = ffi.gc(libre2.RE2_new(pattern, options._to_cdata(flags)),
                               libre2.RE2_delete)
         flag = libre2.ok(self.re2_obj)
         if not flag:
@@ -112,61 +302,124 @@ class CRE2:
             raise ValueError(ffi.string(ret).decode("utf-8"))
 
         self.libre2 = libre2
+        self.groups = libre2.NumCapturingGroups(self.re2_obj)
 
     @staticmethod
-    def __convertToBinaryUTF8(data):
-        if isinstance(data, six.text_type):
-            return data.encode("utf-8")
+    def __convertToBinary(data, encoding="utf-8"):
+        if isinstance(data, text_type):
+            return data.encode(encoding)
         return data
 
+    @staticmethod
+    def __clampPositions(n, pos, endpos):
+        """Clamp re-style pos/endpos arguments to [0, n], endpos None => n"""
+        pos = min(max(pos, 0), n)
+        endpos = n if endpos is None else min(max(endpos, 0), n)
+        return pos, endpos
+
+    def __prepare(self, s, pos=0, endpos=None):
+        """
+        Get the arguments for the C matching API for the window [pos, endpos)
+        of s, which is either a string, a binary string or a PreparedText:
+        (string, binary data, index LUT, bytePositions, startidx, endidx, charBase)
+        Returns None if the window is empty (endpos < pos).
+
+        Positions in strings are character indices. Only the window (plus
+        one character of context for ^ and \\b) is encoded, so the cost does
+        not depend on pos. Positions in binary strings are byte offsets.
+        The LUT is NULL if the C API maps the window itself.
+        """
+        if isinstance(s, PreparedText):
+            if s.encoding != self.encoding:
+                raise ValueError("PreparedText encoding {0} does not match regex encoding {1}".format(
+                    s.encoding, self.encoding))
+            if isinstance(s.string, text_type):
+                pos, endpos = CRE2.__clampPositions(len(s.string), pos, endpos)
+                if endpos < pos:
+                    return None
+                return (s.string, s.data, s._index_lut(), False,
+                        s._byte_offset(pos), s._byte_offset(endpos), pos)
+            s = s.data
+        if isinstance(s, text_type):
+            pos, endpos = CRE2.__clampPositions(len(s), pos, endpos)
+            if endpos < pos:
+                return None
+            ctx = 1 if pos > 0 else 0
+            # RE2 needs binary data, so we'll need to encode it
+            window = s[pos - ctx:endpos]
+            data = window.encode(self.encoding)
+            startidx = len(window[:ctx].encode(self.encoding))
+            return s, data, ffi.NULL, False, startidx, len(data), pos
+        pos, endpos = CRE2.__clampPositions(len(s), pos, endpos)
+        if endpos < pos:
+            return None
+        return s, s, ffi.NULL, True, pos, endpos, pos
+
     @staticmethod
     def __rangeToTuple(r):
         """Convert a CFFI/CRE2 range object to a Python tuple"""
         return (r.start, r.end)
 
-    def search(self, data, flags=0):
-        return self.__search(data, False)  # 0 => UNANCHORED
+    def search(self, data, pos=0, endpos=None, flags=0, buffer=None):
+        return self.__search(data, False, pos, endpos, buffer)  # 0 => UNANCHORED
 
-    def match(self, data, flags=0):
-        return self.__search(data, True)  # 0 => ANCHOR_BOTH
+    def match(self, data, pos=0, endpos=None, flags=0, buffer=None):
+        return self.__search(data, True, pos, endpos, buffer)  # 0 => ANCHOR_BOTH
 
-    def __search(self, s, fullMatch=False, startidx=0):
+    def __search(self, s, fullMatch=False, pos=0, endpos=None, buffer=None):
         """
         Search impl that can either be performed in full or partial match
-        mode, depending on the anchor argument
+        mode, depending on the anchor argument.
+        pos and endpos behave like in re: the text is treated as if it
+        ended at endpos (so $ matches there) and ^ does not match at pos
+        unless pos is 0. They are passed to RE2 as startpos and endpos.
+        The result ranges are written to buffer (a MatchBuffer) if given.
         """
-        # RE2 needs binary data, so we'll need to encode it
-        data = CRE2.__convertToBinaryUTF8(s)
-
-        matchobj = libre2.FindSingleMatch(self.re2_obj, data, fullMatch, startidx)
-        if matchobj.hasMatch:
-            ranges = [CRE2.__rangeToTuple(matchobj.ranges[i])
-                      for i in range(matchobj.numGroups)]
-            ret = MatchObject(self, s, ranges)
+        args = self.__prepare(s, pos, endpos)
+        if args is None:
+            return None
+        s, data, lut, bytePositions, startidx, endidx, charBase = args
+
+        numGroups = self.groups + 1
+        if buffer is None:
+            ranges = ffi.new("Range[]", numGroups)
         else:
-            ret = None
-        # Cleanup C API objects
-        libre2.FreeREMatchResult(matchobj)
-        return ret
+            ranges = buffer._ensure(numGroups)
+        n = libre2.FindSingleMatchInto(self.re2_obj, data, len(data), lut, bytePositions,
+                                       fullMatch, startidx, endidx, charBase, ranges, numGroups)
+        if n <= 0:
+            return None
+        return MatchObject(self, s, [CRE2.__rangeToTuple(ranges[i]) for i in range(n)])
 
-    def findall(self, data, flags=0):
-        return list(self.finditer(data, flags))
+    def findall(self, data, pos=0, endpos=None, flags=0, buffer=None):
+        return list(self.finditer(data, pos, endpos, flags, buffer=buffer))
 
-    def finditer(self, s, flags=0, generateMO=False):
+    def finditer(self, s, pos=0, endpos=None, flags=0, generateMO=False, buffer=None):
         """
         re.finditer-compatible function.
         Set generateMO to True to generate match objects instead of tuples.
+        If buffer (a MatchBuffer) is given, the match ranges are written
+        to it instead of newly allocated memory.
         """
-        data = CRE2.__convertToBinaryUTF8(s)
+        args = self.__prepare(s, pos, endpos)
+        if args is None:
+            return
+        s, data, lut, bytePositions, startidx, endidx, charBase = args
 
         # Anchor currently fixed to 0 == UNANCHORED
-        matchobj = libre2.FindAllMatches(self.re2_obj, data, 0, 0)
+        if buffer is None:
+            matchobj = libre2.FindAllMatches(self.re2_obj, data, len(data), lut, bytePositions,
+                                             0, startidx, endidx, charBase)
+            matches = CRE2.__parseFindallMatchObj(matchobj)
+        else:
+            matchobj = None
+            matches = self.__findAllInto(args[1:], buffer)
 
         if generateMO:
-            for ranges in CRE2.__parseFindallMatchObj(matchobj):
+            for ranges in matches:
                 yield MatchObject(self, s, ranges)
         else:  # Do not generate match objects
-            for tp in CRE2.__parseFindallMatchObj(matchobj):
+            for tp in matches:
                 # len == 1 => No groups, only full match:
                 if len(tp) == 1:
                     yield s[slice(*tp[0])]
@@ -175,7 +428,26 @@ class CRE2:
                 else:
                     yield tuple((s[slice(*t)] for t in tp[1:]))
 
-        libre2.FreeREMultiMatchResult(matchobj)
+        if matchobj is not None:
+            libre2.FreeREMultiMatchResult(matchobj)
+
+    def __findAllInto(self, args, buffer):
+        """
+        FindAllMatches using a MatchBuffer. args are the prepared
+        (data, lut, bytePositions, startidx, endidx, charBase).
+        Returns a list of range tuples, one per match,
+        so the buffer may be reused while iterating.
+        """
+        data, lut, bytePositions, startidx, endidx, charBase = args
+        m = self.groups + 1
+        n = libre2.FindAllMatchesInto(self.re2_obj, data, len(data), lut, bytePositions,
+                                      0, startidx, endidx, charBase, buffer._ranges, buffer.size)
+        if n * m > buffer.size:  # Not all matches fit, grow and fetch the rest
+            buffer._ensure(n * m)
+            libre2.CopyLastMatches(buffer._ranges, n * m)
+        ranges = buffer._ranges
+        return [tuple(CRE2.__rangeToTuple(ranges[i * m + j]) for j in range(m))
+                for i in range(n)]
 
     @staticmethod
     def __parseFindallMatchObj(matchobj):
@@ -189,9 +461,12 @@ class CRE2:
 
     def _sub_function(self, fn, s, count=0, flags=0):
         """This is internally called if repl in re.sub() is a function"""
+        matches = self.finditer(s, flags=flags, generateMO=True)
+        if isinstance(s, PreparedText):
+            s = s.string
         # Find all matches
         ofs = 0  # We might accumulate index shifts if len(replacement) != len(match)
-        for match in self.finditer(s, flags, generateMO=True):
+        for match in matches:
             start, end = match.span(0)
             replacement = fn(match)
             #print(match.group(0) + " / " + replacement)
@@ -204,16 +479,59 @@ class CRE2:
         if hasattr(repl, '__call__'):
             return self._sub_function(repl, s, count, flags)
 
-        # Convert all strings to UTF8
-        repl = CRE2.__convertToBinaryUTF8(repl)
-        s = CRE2.__convertToBinaryUTF8(s)
+        # Convert all strings to the regex encoding
+        repl = CRE2.__convertToBinary(repl, self.encoding)
+        if isinstance(s, PreparedText):
+            s = s.data
+        s = CRE2.__convertToBinary(s, self.encoding)
 
         c_p_str = self.libre2.RE2_GlobalReplace(self.re2_obj, s, repl)
 
         py_string = ffi.string(self.libre2.get_c_str(c_p_str))
         # Cleanup C API objects
         self.libre2.RE2_delete_string_ptr(c_p_str)
-        return py_string.decode("utf-8")
+        return py_string.decode(self.encoding)
+
+    def possible_match_range(self, maxlen=10):
+        """
+        Compute a (min, max) pair of byte strings such that any string
+        that is matched by this regex at its start (see match())
+        satisfies min <= s <= max, comparing the encoded bytes of s.
+        Only the first maxlen bytes are considered.
+        This allows pruning sorted key ranges before running the regex.
+        Returns None if RE2 cannot determine a range, e.g. for
+        regexes that start with \\C*
+        """
+        c_min = ffi.new("void**")
+        c_max = ffi.new("void**")
+        if not self.libre2.RE2_PossibleMatchRange(self.re2_obj, c_min, c_max, maxlen):
+            return None
+        ret = (CRE2.__stringPtrToBytes(c_min[0]), CRE2.__stringPtrToBytes(c_max[0]))
+        # Cleanup C API objects
+        self.libre2.RE2_delete_string_ptr(c_min[0])
+        self.libre2.RE2_delete_string_ptr(c_max[0])
+        return ret
+
+    def required_prefix(self, maxlen=10):
+        """
+        Compute the literal byte string every match at the start of the
+        subject (see match()) must begin with, i.e. the common prefix of
+        possible_match_range(maxlen). Returns b'' if there is no such prefix.
+        For search(), this only applies to patterns anchored with ^.
+        """
+        match_range = self.possible_match_range(maxlen)
+        if match_range is None:
+            return b''
+        lo, hi = match_range
+        n = 0
+        while n < min(len(lo), len(hi)) and lo[n:n + 1] == hi[n:n + 1]:
+            n += 1
+        return lo[:n]
+
+    @staticmethod
+    def __stringPtrToBytes(ptr):
+        """Copy a C++ string* into a Python bytes object, including NUL bytes"""
+        return ffi.buffer(libre2.get_c_str(ptr), libre2.get_str_size(ptr))[:]
 
 def compile(pattern, *args, **kwargs):
     return CRE2(pattern, *args, **kwargs)
@@ -231,21 +549,21 @@ def search(pattern, string, flags=0):
     Module-level sub function. See re.search() for details
     """
     rgx = compile(pattern, flags & I)
-    return rgx.search(string, flags)
+    return rgx.search(string)
 
 def match(pattern, string, flags=0):
     """
     Module-level match function. See re.match() for details
     """
     rgx = compile(pattern, flags & I)
-    return rgx.match(string, flags)
+    return rgx.match(string)
 
 def finditer(pattern, string, flags=0):
     """
     Module-level finditer function. See re.finditer() for details
     """
     rgx = compile(pattern, flags & I)
-    for result in rgx.finditer(string, flags):
+    for result in rgx.finditer(string):
         yield result
 
 def findall(pattern, string, flags=0):
@@ -253,7 +571,7 @@ def findall(pattern, string, flags=0):
     Module-level findall function. See re.findall() for details
     """
     rgx = compile(pattern, flags & I)
-    return rgx.findall(string, flags)
+    return rgx.findall(string)
 
 def set_max_memory_budget(maxmem):
     """
@@ -264,4 +582,4 @@ def set_max_memory_budget(maxmem):
     Affects only regexes compiled after this call, so it is recommended to do this
     directly after importing cffi_re2.
     """
-    libre2.RE2_SetMaxMemory(maxmem)
+    _load_libre2().RE2_SetMaxMemory(maxmem)
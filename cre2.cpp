@@ -2,10 +2,14 @@
 #include <string>
 #include <iostream>
 #include <vector>
+#include <algorithm>
+#include <stdint.h>
 
 using namespace std;
 
-static int maxMemoryBudget = 128 << 20; // 128 MiB
+static int64_t maxMemoryBudget = 128 << 20; // 128 MiB
+//Per-thread scratch buffers larger than this are released after each call
+static const size_t scratchHighWaterMark = 1 << 20; // 1 MiB
 
 typedef struct {
     int start;
@@ -41,22 +45,47 @@ typedef struct {
     Range** ranges;
 } REMultiMatchResult;
 
+/**
+ * Compilation options, mirroring the relevant subset of re2::RE2::Options.
+ * Filled in on the Python side (see cffi_re2.Options).
+ */
+typedef struct {
+    /**
+     * 0 => UTF8, 1 => Latin1
+     */
+    int encoding;
+    bool posixSyntax;
+    bool longestMatch;
+    bool literal;
+    bool neverNl;
+    bool dotNl;
+    bool neverCapture;
+    bool caseSensitive;
+    bool perlClasses;
+    bool wordBoundary;
+    bool oneLine;
+    /**
+     * Maximum memory budget in bytes. <= 0 => use the global budget
+     */
+    int64_t maxMem;
+} REOptions;
+
 //clrsb: Number of leading bits equal to the sign bit (which we set to 0)
 //clrsb(~b) - clrsb(0) + 8: Number of leading one bits in the byte b
 #define count_leading_ones(b) __builtin_clrsb(~(char)(b))  - __builtin_clrsb(0) + 8
 
 /**
- * Builds a lookup table (LUT) that allows mapping a cstring (memory) index
+ * Fills a lookup table (LUT) that allows mapping a cstring (memory) index
  * of a string to lookup (key: cstring coordinate) the character index in a UTF8 string.
  * 
  * Example: abcödef -> 0 1 2 3 3 4 5 6
  * @param s The string to map
  * @param len The length of s
- * @return a new[]-allocated int array of size len, containing the LUT
+ * @param lut The int array of size len + 1 to fill
+ * @param base The character index of s[0], added to every entry
  */
-int* buildUTF8IndexLUT(const char* s, size_t len) {
-    int* lut = new int[len + 1];
-    int sidx = 0; // Index in the LUT
+void fillUTF8IndexLUT(const char* s, size_t len, int* lut, int base) {
+    int sidx = base; // Index in the LUT
     for(unsigned int i = 0 ; i < len ; i++) { // i = Current index in s
         if((s[i] & 0x80) == 0) { //Single-byte character
             lut[i] = sidx;
@@ -64,7 +93,7 @@ int* buildUTF8IndexLUT(const char* s, size_t len) {
         } else { //Start of multibyte. This branch handles the entire multibyte
             int multibyteSize = count_leading_ones(s[i]);
             //Set the next <multibyteSize> LUT entries to the current sidx
-            for(unsigned int j = i; j < multibyteSize + i; j++) {
+            for(unsigned int j = i; j < multibyteSize + i && j < len; j++) {
                 lut[j] = sidx;
             }
             //Advance i to after the multibyte, but advance sidx by only 1
@@ -74,9 +103,20 @@ int* buildUTF8IndexLUT(const char* s, size_t len) {
         }
     }
     //Last entry is relevant when a group ends at the end of the string.
-    // This behaviour leverages Python slicing automatically limiting the end index
-    lut[len] = len;
-    return lut;
+    // It maps to the number of characters in s
+    lut[len] = sidx;
+}
+
+/**
+ * Fills a lookup table (LUT) for a Latin1 string, i.e. an identity mapping
+ * (every byte is exactly one character).
+ * @param len The length of the string to map
+ * @param lut The int array of size len + 1 to fill
+ */
+void fillLatin1IndexLUT(size_t len, int* lut) {
+    for(size_t i = 0 ; i <= len ; i++) {
+        lut[i] = i;
+    }
 }
 
 /**
@@ -85,6 +125,243 @@ int* buildUTF8IndexLUT(const char* s, size_t len) {
 static const re2::RE2::Anchor anchorLUT[] = {
     re2::RE2::UNANCHORED, re2::RE2::ANCHOR_BOTH, re2::RE2::ANCHOR_START};
 
+/**
+ * Per-thread scratch buffers that are reused across calls,
+ * so the matching path does not allocate in the steady state.
+ */
+struct Scratch {
+    vector<re2::StringPiece> submatches;
+    vector<int> lut;
+    /**
+     * Flat match ranges, numElements entries per match
+     */
+    vector<Range> ranges;
+    /**
+     * Number of times any scratch buffer was (re)allocated, for testing
+     */
+    int allocations;
+
+    Scratch() : allocations(0) {}
+
+    /**
+     * Resize v to at least n elements, counting reallocations
+     */
+    template<typename T>
+    T* grow(vector<T>& v, size_t n) {
+        if(v.size() < n) {
+            size_t oldCapacity = v.capacity();
+            v.resize(n);
+            if(v.capacity() != oldCapacity) {
+                allocations++;
+            }
+        }
+        return v.data();
+    }
+
+    re2::StringPiece* getSubmatches(int n) {
+        return grow(submatches, n);
+    }
+
+    /**
+     * Get a UTF8 index LUT for the len bytes at s, see fillUTF8IndexLUT
+     */
+    const int* getIndexLUT(const char* s, size_t len, int base) {
+        int* lutData = grow(lut, len + 1);
+        fillUTF8IndexLUT(s, len, lutData, base);
+        return lutData;
+    }
+
+    /**
+     * Append n ranges to ranges and return a pointer to them
+     */
+    Range* appendRanges(int n) {
+        size_t old = ranges.size();
+        return grow(ranges, old + n) + old;
+    }
+
+    /**
+     * Release the memory of v if it grew beyond the high-water mark
+     */
+    template<typename T>
+    void trimVector(vector<T>& v) {
+        if(v.capacity() * sizeof(T) > scratchHighWaterMark) {
+            vector<T>().swap(v);
+        }
+    }
+
+    /**
+     * Call after every use to shrink buffers past the high-water mark.
+     * Set keepRanges to keep the ranges for CopyLastMatches
+     */
+    void trim(bool keepRanges = false) {
+        trimVector(submatches);
+        trimVector(lut);
+        if(!keepRanges) {
+            trimVector(ranges);
+        }
+    }
+};
+
+static thread_local Scratch scratch;
+
+/**
+ * Number of characters in the UTF8 string s of length len,
+ * i.e. the number of bytes that are not continuation bytes
+ */
+int countUTF8Chars(const char* s, size_t len) {
+    int n = 0;
+    for(size_t i = 0 ; i < len ; i++) {
+        n += (s[i] & 0xC0) != 0x80;
+    }
+    return n;
+}
+
+/**
+ * Maps match byte offsets to character indices for the window of data
+ * starting at byte offset startidx, which has the character index charBase.
+ * Matches must be mapped in ascending order.
+ *
+ * With a prebuilt LUT for the entire data, it is used directly.
+ * Latin1 data and byte positions map by shifting the offset.
+ * Otherwise, characters are counted up to the start of every match and
+ * only the match itself is mapped using the scratch LUT, so the scratch
+ * size does not depend on the size of the data.
+ */
+class IndexMapper {
+public:
+    IndexMapper(const re2::RE2* re_obj, const char* dataArg, const int* lut,
+                bool bytePositions, size_t startidx, int charBase)
+        : dataArg(dataArg), lut(lut), cursorByte(startidx), cursorChar(charBase) {
+        identity = lut == NULL && (bytePositions ||
+            re_obj->options().encoding() == re2::RE2::Options::EncodingLatin1);
+    }
+
+    /**
+     * Convert RE2 submatches to character index ranges. Unmatched groups map to (-1, -1)
+     */
+    void copyRanges(const re2::StringPiece* groups, int numGroups, Range* out) {
+        const int* indexLUT = lut;
+        size_t lutStart = 0;
+        if(lut == NULL && !identity) {
+            //Count characters up to the match, then map the match only
+            size_t matchStart = groups[0].data() - dataArg;
+            if(matchStart > cursorByte) {
+                cursorChar += countUTF8Chars(dataArg + cursorByte, matchStart - cursorByte);
+                cursorByte = matchStart;
+            }
+            indexLUT = scratch.getIndexLUT(dataArg + matchStart, groups[0].size(), cursorChar);
+            lutStart = matchStart;
+        }
+        for (int i = 0; i < numGroups; ++i) {
+            if(groups[i].data() == NULL) {
+                out[i].start = -1;
+                out[i].end = -1;
+                continue;
+            }
+            size_t rawStart = groups[i].data() - dataArg;
+            size_t rawEnd = rawStart + groups[i].size();
+            if(indexLUT != NULL) {
+                out[i].start = indexLUT[rawStart - lutStart];
+                out[i].end = indexLUT[rawEnd - lutStart];
+            } else {
+                out[i].start = (int)(rawStart - cursorByte) + cursorChar;
+                out[i].end = (int)(rawEnd - cursorByte) + cursorChar;
+            }
+        }
+    }
+
+private:
+    const char* dataArg;
+    const int* lut;
+    bool identity;
+    size_t cursorByte;
+    int cursorChar;
+};
+
+/**
+ * Find the first match, writing numGroups ranges to out.
+ * startidx and endidx are byte offsets into data. The text is cut off
+ * at endidx (so $ matches there), the bytes before startidx are only
+ * used as context for ^ and \b.
+ * lut is a prebuilt index LUT for the entire data (see BuildIndexLUT)
+ * or NULL, in which case the window is mapped using the per-thread
+ * scratch LUT, with charBase being the character index of startidx.
+ * If bytePositions is set, the reported ranges are byte offsets
+ * shifted by charBase - startidx instead.
+ */
+bool findSingleMatch(re2::RE2* re_obj, const char* dataArg, int len, const int* lut, bool bytePositions,
+                     bool startAnchored, int startidx, int endidx, int charBase,
+                     int numGroups, Range* out) {
+    endidx = max(0, min(endidx, len));
+    re2::StringPiece data(dataArg, endidx);
+    if(startidx < 0 || startidx > endidx) {
+        return false;
+    }
+    re2::StringPiece* groups = scratch.getSubmatches(numGroups);
+    //Perform either
+    re2::RE2::Anchor anchor = startAnchored ? re2::RE2::ANCHOR_START : re2::RE2::UNANCHORED;
+    bool hasMatch = re_obj->Match(data, startidx, endidx,
+            anchor, groups, numGroups);
+    if(hasMatch) {
+        IndexMapper(re_obj, dataArg, lut, bytePositions, startidx, charBase)
+            .copyRanges(groups, numGroups, out);
+    }
+    scratch.trim();
+    return hasMatch;
+}
+
+/**
+ * Find all non-overlapping matches and store their ranges in scratch.ranges,
+ * numElements ranges per match. Returns the number of matches.
+ * See findSingleMatch for the meaning of the arguments.
+ */
+int findAllMatches(re2::RE2* re_obj, const char* dataArg, int len, const int* lut, bool bytePositions,
+                   int anchorArg, int startidx, int endidx, int charBase, int numElements) {
+    scratch.ranges.clear();
+    endidx = max(0, min(endidx, len));
+    re2::StringPiece data(dataArg, endidx);
+    if(startidx < 0 || startidx > endidx) {
+        return 0;
+    }
+    if(anchorArg >= 2) {
+        anchorArg = 0; //Should not happen
+    }
+    re2::RE2::Anchor anchor = anchorLUT[anchorArg];
+    IndexMapper indexMapper(re_obj, dataArg, lut, bytePositions, startidx, charBase);
+    //Zero-length matches advance by one character, which might be multiple bytes
+    bool utf8Chars = !bytePositions &&
+        re_obj->options().encoding() != re2::RE2::Options::EncodingLatin1;
+    re2::StringPiece* matchTmp = scratch.getSubmatches(numElements);
+    int numMatches = 0;
+    size_t pos = startidx;
+    /**
+     * Iterate over all non-overlapping (!) matches
+     */
+    while(pos <= (size_t)endidx) {
+        //Perform match
+        bool hasMatch = re_obj->Match(data, pos, endidx,
+             anchor, matchTmp, numElements);
+        if(!hasMatch) {
+            break;
+        }
+        //Increment position pointer so we get the next hit
+        // We are returning non-overlapping matches, so this is OK
+        if(matchTmp[0].size() == 0) { //Zero-length match
+            pos = matchTmp[0].data() - dataArg + 1;
+            //Skip UTF8 continuation bytes
+            while(utf8Chars && pos < (size_t)endidx && (dataArg[pos] & 0xC0) == 0x80) {
+                pos++;
+            }
+        } else {
+            pos = matchTmp[0].data() - dataArg + matchTmp[0].size() ;
+        }
+        //Copy range
+        indexMapper.copyRanges(matchTmp, numElements, scratch.appendRanges(numElements));
+        numMatches++;
+    }
+    return numMatches;
+}
+
 /**
  * Copy a StringPiece array to a C string list,
  * each level of which is allocated using new[]
@@ -102,17 +379,66 @@ char** copyGroups(const re2::StringPiece* groupsSrc, int numGroups) {
 }
 
 extern "C" {
-    re2::RE2* RE2_new(const char* pattern, bool caseInsensitive) {
+    re2::RE2* RE2_new(const char* pattern, const REOptions* opts) {
         re2::RE2::Options options;
         options.Copy(re2::RE2::Quiet);
-        if(caseInsensitive) {
-            options.set_case_sensitive(false);
-        }
-        options.set_max_mem(maxMemoryBudget);
+        options.set_encoding(opts->encoding == 1 ?
+            re2::RE2::Options::EncodingLatin1 : re2::RE2::Options::EncodingUTF8);
+        options.set_posix_syntax(opts->posixSyntax);
+        options.set_longest_match(opts->longestMatch);
+        options.set_literal(opts->literal);
+        options.set_never_nl(opts->neverNl);
+        options.set_dot_nl(opts->dotNl);
+        options.set_never_capture(opts->neverCapture);
+        options.set_case_sensitive(opts->caseSensitive);
+        options.set_perl_classes(opts->perlClasses);
+        options.set_word_boundary(opts->wordBoundary);
+        options.set_one_line(opts->oneLine);
+        options.set_max_mem(opts->maxMem > 0 ? opts->maxMem : maxMemoryBudget);
         re2::RE2* ptr = new re2::RE2(pattern, options);
         return ptr;
     }
 
+    /**
+     * Build an index LUT for the entire data, to be passed to
+     * FindSingleMatch/FindAllMatches for repeated matching.
+     * Must be freed using FreeIndexLUT.
+     */
+    int* BuildIndexLUT(const char* data, int len, bool latin1) {
+        int* lut = new int[len + 1];
+        if(latin1) {
+            fillLatin1IndexLUT(len, lut);
+        } else {
+            fillUTF8IndexLUT(data, len, lut, 0);
+        }
+        return lut;
+    }
+
+    void FreeIndexLUT(int* lut) {
+        delete[] lut;
+    }
+
+    /**
+     * Build a table that maps every character index of the UTF8 data
+     * (which contains numChars characters) to its byte offset.
+     * The last entry maps numChars to len.
+     * Must be freed using FreeCharOffsetTable.
+     */
+    int* BuildCharOffsetTable(const char* data, int len, int numChars) {
+        int* table = new int[numChars + 1];
+        int c = 0;
+        for(int i = 0 ; i < len && c < numChars ; c++) {
+            table[c] = i;
+            i += (data[i] & 0x80) == 0 ? 1 : count_leading_ones(data[i]);
+        }
+        table[c] = len;
+        return table;
+    }
+
+    void FreeCharOffsetTable(int* table) {
+        delete[] table;
+    }
+
     int NumCapturingGroups(re2::RE2* re_obj) {
         return re_obj->NumberOfCapturingGroups();
     }
@@ -126,123 +452,112 @@ extern "C" {
 
     void FreeREMultiMatchResult(REMultiMatchResult mr) {
         if(mr.ranges != NULL) {
-            for (int i = 0; i < mr.numMatches; ++i) {
-                if(mr.ranges[i] != NULL) {
-                    delete[] mr.ranges[i];
-                    mr.ranges[i] = NULL;
-                }
-            }
+            //All matches share a single block, see FindAllMatches
+            delete[] mr.ranges[0];
             delete[] mr.ranges;
             mr.ranges = NULL;
         }
     }
 
-    REMultiMatchResult FindAllMatches(re2::RE2* re_obj, const char* dataArg, int anchorArg, int startpos) {
-        re2::StringPiece data(dataArg);
-        if(anchorArg >= 2) {
-            anchorArg = 0; //Should not happen
-        }
-        re2::RE2::Anchor anchor = anchorLUT[anchorArg];
-        //Build UTF8 lookup table for string
-        int* utf8LUT = buildUTF8IndexLUT(data.data(), data.size());
-        //Initialize return arg
+    /**
+     * See findSingleMatch for the meaning of the arguments.
+     */
+    REMultiMatchResult FindAllMatches(re2::RE2* re_obj, const char* dataArg, int len, const int* lut,
+                                      bool bytePositions, int anchorArg, int startidx, int endidx,
+                                      int charBase) {
         REMultiMatchResult ret;
-        ret.numMatches = 0;
-        //Map anchor for easier Python iface
-        int numGroups = re_obj->NumberOfCapturingGroups();
-        ret.numElements = 1 + numGroups;
-        int pos = startpos;
-        int endidx = data.size();
-        //We don't know the size of this in advance, so we'll need to allocate now
-        re2::StringPiece* matchTmp = new re2::StringPiece[ret.numElements];
-        vector<Range*> allRanges;
-        /**
-         * Iterate over all non-overlapping (!) matches
-         */
-        while(true) {
-            //Perform match
-            bool hasMatch = re_obj->Match(data, pos, endidx,
-                 anchor, matchTmp, ret.numElements);
-            if(!hasMatch) {
-                break;
-            }
-            //Increment position pointer so we get the next hit
-            // We are returning non-overlapping matches, so this is OK
-            if(matchTmp[0].size() == 0) { //Zero-length match
-                pos++;
-            } else {
-                pos = matchTmp[0].data() - dataArg + matchTmp[0].size() ;
-            }
-            //Copy range
-            Range* rangeTmp = new Range[ret.numElements];
-            for (int i = 0; i < ret.numElements; ++i) {
-                if(matchTmp[i].data() == NULL) {
-                    rangeTmp[i].start = -1;
-                    rangeTmp[i].end = -1;
-                    continue;
-                }
-                int rawStart = matchTmp[i].data() - dataArg;
-                rangeTmp[i].start = utf8LUT[rawStart];
-                rangeTmp[i].end = utf8LUT[rawStart + matchTmp[i].size()];
-            }
-            allRanges.push_back(rangeTmp);
-        }
-        //Compute final size
-        ret.numMatches = allRanges.size();
-        //Convert match vector to group vector (3D)
-        ret.ranges = new Range*[allRanges.size()];
-        for (size_t i = 0; i < allRanges.size(); ++i) {
-            //Copy ranges
-            ret.ranges[i] = new Range[ret.numElements];
-            memcpy(ret.ranges[i], allRanges[i], sizeof(Range*) * ret.numElements);
-        }
-        //Cleanup
-        delete[] utf8LUT;
-        delete[] matchTmp;
-        for (size_t i = 0; i < allRanges.size(); ++i) {
-            if(allRanges[i] != NULL) {
-                delete[] allRanges[i];
+        ret.numElements = 1 + re_obj->NumberOfCapturingGroups();
+        ret.numMatches = findAllMatches(re_obj, dataArg, len, lut, bytePositions,
+                                        anchorArg, startidx, endidx, charBase, ret.numElements);
+        ret.ranges = NULL;
+        if(ret.numMatches > 0) {
+            //Copy ranges into a single block, indexed by one pointer per match
+            Range* block = new Range[ret.numMatches * ret.numElements];
+            memcpy(block, scratch.ranges.data(), sizeof(Range) * ret.numMatches * ret.numElements);
+            ret.ranges = new Range*[ret.numMatches];
+            for (int i = 0; i < ret.numMatches; ++i) {
+                ret.ranges[i] = block + i * ret.numElements;
             }
         }
+        scratch.trim();
         return ret;
     }
 
-    REMatchResult FindSingleMatch(re2::RE2* re_obj, const char* dataArg, bool startAnchored, int startpos) {
-        re2::StringPiece data(dataArg);
+    /**
+     * Like FindAllMatches, but writes the ranges of the first
+     * outSize / (NumCapturingGroups() + 1) matches to the
+     * caller-provided out buffer and does not allocate.
+     * Returns the total number of matches. If they do not all fit into out,
+     * use CopyLastMatches to fetch them without matching again.
+     */
+    int FindAllMatchesInto(re2::RE2* re_obj, const char* dataArg, int len, const int* lut,
+                           bool bytePositions, int anchorArg, int startidx, int endidx,
+                           int charBase, Range* out, int outSize) {
+        int numElements = 1 + re_obj->NumberOfCapturingGroups();
+        int numMatches = findAllMatches(re_obj, dataArg, len, lut, bytePositions,
+                                        anchorArg, startidx, endidx, charBase, numElements);
+        int numCopied = min(numMatches, outSize / numElements);
+        memcpy(out, scratch.ranges.data(), sizeof(Range) * numCopied * numElements);
+        //Keep the ranges for CopyLastMatches if they did not all fit
+        scratch.trim(numCopied < numMatches);
+        return numMatches;
+    }
+
+    /**
+     * Copy up to outSize ranges of the last FindAllMatchesInto call
+     * on this thread to out. Returns the number of ranges copied.
+     */
+    int CopyLastMatches(Range* out, int outSize) {
+        int n = min((size_t)outSize, scratch.ranges.size());
+        memcpy(out, scratch.ranges.data(), sizeof(Range) * n);
+        scratch.trim();
+        return n;
+    }
+
+    /**
+     * Number of (re)allocations of the per-thread scratch buffers
+     * of the calling thread
+     */
+    int GetScratchAllocations() {
+        return scratch.allocations;
+    }
+
+    /**
+     * See findSingleMatch for the meaning of the arguments.
+     */
+    REMatchResult FindSingleMatch(re2::RE2* re_obj, const char* dataArg, int len, const int* lut,
+                                  bool bytePositions, bool startAnchored, int startidx, int endidx,
+                                  int charBase) {
         REMatchResult ret;
         ret.numGroups = re_obj->NumberOfCapturingGroups() + 1;
-        //Declare group target array
-        re2::StringPiece* groups = new re2::StringPiece[ret.numGroups]();
-        //Build UTF8 lookup table for string
-        int* utf8LUT = buildUTF8IndexLUT(data.data(), data.size());
-        //Perform either
-        re2::RE2::Anchor anchor = startAnchored ? re2::RE2::ANCHOR_START : re2::RE2::UNANCHORED;
-        ret.hasMatch = re_obj->Match(data, startpos, data.size(),
-                anchor, groups, ret.numGroups);
-        //Copy groups
-        if(ret.hasMatch) {
-            //Copy ranges
-            ret.ranges = new Range[ret.numGroups];
-            for (int i = 0; i < ret.numGroups; ++i) {
-                if(groups[i].data() == NULL) {
-                    ret.ranges[i].start = -1;
-                    ret.ranges[i].end = -1;
-                    continue;
-                }
-                int rawStart = groups[i].data() - dataArg;
-                ret.ranges[i].start = utf8LUT[rawStart];
-                ret.ranges[i].end = utf8LUT[rawStart + groups[i].size()];
-            }
-        } else {
+        ret.ranges = new Range[ret.numGroups];
+        ret.hasMatch = findSingleMatch(re_obj, dataArg, len, lut, bytePositions, startAnchored,
+                                       startidx, endidx, charBase, ret.numGroups, ret.ranges);
+        if(!ret.hasMatch) {
+            delete[] ret.ranges;
             ret.ranges = NULL;
         }
-        //Cleanup
-        delete[] groups;
-        delete[] utf8LUT;
-        //Return
         return ret;
     }
 
+    /**
+     * Like FindSingleMatch, but writes the ranges to the caller-provided
+     * out buffer and does not allocate.
+     * Returns the number of ranges (NumCapturingGroups() + 1) on match,
+     * 0 if there is no match and -1 if out is too small.
+     */
+    int FindSingleMatchInto(re2::RE2* re_obj, const char* dataArg, int len, const int* lut,
+                            bool bytePositions, bool startAnchored, int startidx, int endidx,
+                            int charBase, Range* out, int outSize) {
+        int numGroups = re_obj->NumberOfCapturingGroups() + 1;
+        if(outSize < numGroups) {
+            return -1;
+        }
+        bool hasMatch = findSingleMatch(re_obj, dataArg, len, lut, bytePositions, startAnchored,
+                                        startidx, endidx, charBase, numGroups, out);
+        return hasMatch ? numGroups : 0;
+    }
+
     void RE2_delete(re2::RE2* re_obj) {
         delete re_obj;
     }
@@ -262,6 +577,34 @@ extern "C" {
         return ptr_str->c_str();
     }
 
+    int get_str_size(string* ptr_str) {
+        if(ptr_str == NULL) {
+            return 0;
+        }
+        return ptr_str->size();
+    }
+
+    /**
+     * Wrapper for RE2::PossibleMatchRange.
+     * On success, *min and *max are set to new-allocated strings
+     * which need to be freed using RE2_delete_string_ptr.
+     * On failure, both are set to NULL.
+     */
+    bool RE2_PossibleMatchRange(re2::RE2* re_obj, string** min, string** max, int maxlen) {
+        string* minTmp = new string();
+        string* maxTmp = new string();
+        if(!re_obj->PossibleMatchRange(minTmp, maxTmp, maxlen)) {
+            delete minTmp;
+            delete maxTmp;
+            *min = NULL;
+            *max = NULL;
+            return false;
+        }
+        *min = minTmp;
+        *max = maxTmp;
+        return true;
+    }
+
     void RE2_delete_string_ptr(string* ptr) {
         delete ptr;
     }
@@ -281,7 +624,7 @@ extern "C" {
         return re_obj->ok();
     }
 
-    void RE2_SetMaxMemory(int maxmem) {
+    void RE2_SetMaxMemory(int64_t maxmem) {
         maxMemoryBudget = maxmem;
     }
 
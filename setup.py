@@ -21,7 +21,7 @@ setup(
     name='cffi_re2',
     license='MIT license',
     packages=find_packages(exclude=['tests*']),
-    install_requires=['cffi>=0.7', 'six'],
+    install_requires=['cffi>=0.7'],
     ext_modules=[mod_cre2],
     zip_safe=False,
     test_suite='nose.collector',
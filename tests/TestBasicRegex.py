@@ -5,9 +5,9 @@ import sys
 import re as pyre
 if sys.version_info < (2, 7):
     from nose.tools import raises
-    from nose_extra_tools import assert_is_not_none, assert_is_none, assert_equal, assert_true, assert_false
+    from nose_extra_tools import assert_is_not_none, assert_is_none, assert_equal, assert_true, assert_false, assert_less
 else:
-    from nose.tools import raises, assert_is_not_none, assert_is_none, assert_equal, assert_true, assert_false
+    from nose.tools import raises, assert_is_not_none, assert_is_none, assert_equal, assert_true, assert_false, assert_less
 
 class TestBasicRegex(object):
     def test_basic_search(self):
@@ -194,3 +194,275 @@ class TestChineseRegex(object):
     def test_invalid_regex_2(self):
         p = '(?<![没不])'
         robj = cffi_re2.compile(p)
+
+class TestOptions(object):
+    def test_never_capture(self):
+        rgx = cffi_re2.compile(r'a(b+)', options=cffi_re2.Options(never_capture=True))
+        mo = rgx.search("xabbc")
+        assert_equal(mo.group(0), "abb")
+        assert_equal(mo.groups(), ())
+
+    def test_literal(self):
+        rgx = cffi_re2.compile(r'a.b+', options=cffi_re2.Options(literal=True))
+        assert_is_none(rgx.search("axbb"))
+        assert_equal(rgx.search("xa.b+c").group(0), "a.b+")
+
+    def test_longest_match(self):
+        rgx = cffi_re2.compile(r'a|ab', options=cffi_re2.Options(longest_match=True))
+        assert_equal(rgx.search("abc").group(0), "ab")
+        assert_equal(cffi_re2.compile(r'a|ab').search("abc").group(0), "a")
+
+    def test_never_nl(self):
+        rgx = cffi_re2.compile(r'a[^x]*b', options=cffi_re2.Options(never_nl=True))
+        assert_is_none(rgx.search("a\nb"))
+        assert_is_not_none(rgx.search("a\nab"))
+        assert_is_not_none(cffi_re2.compile(r'a[^x]*b').search("a\nb"))
+
+    def test_posix_syntax(self):
+        # \d is a Perl class, which is unsupported in POSIX syntax by default
+        assert_is_not_none(cffi_re2.compile(r'\d', options=cffi_re2.Options(posix_syntax=True, perl_classes=True)))
+
+    @raises(ValueError)
+    def test_posix_syntax_invalid(self):
+        cffi_re2.compile(r'\d', options=cffi_re2.Options(posix_syntax=True))
+
+    def test_case_sensitive(self):
+        rgx = cffi_re2.compile(r'ab', options=cffi_re2.Options(case_sensitive=False))
+        assert_is_not_none(rgx.match("AB"))
+
+    def test_latin1(self):
+        rgx = cffi_re2.compile(u'ä(b+)', options=cffi_re2.Options(encoding=cffi_re2.Options.ENCODING_LATIN1))
+        mo = rgx.search(u"xäbbc")
+        assert_equal(mo.span(0), (1, 4))
+        assert_equal(mo.group(1), "bb")
+        assert_equal(rgx.sub(u'ö', u"xäbbc"), u"xöc")
+
+    def test_large_max_mem(self):
+        rgx = cffi_re2.compile(r'a(b+)', options=cffi_re2.Options(max_mem=8 << 30))
+        assert_equal(rgx.search("xabbc").group(1), "bb")
+
+    def test_large_max_memory_budget(self):
+        cffi_re2.set_max_memory_budget(4 << 30)
+        try:
+            assert_equal(cffi_re2.search(r'a(b+)', "xabbc").group(1), "bb")
+        finally:
+            cffi_re2.set_max_memory_budget(128 << 20)
+
+    @raises(ValueError)
+    def test_invalid_encoding(self):
+        cffi_re2.Options(encoding="utf-16")
+
+class TestMatchRange(object):
+    def test_possible_match_range(self):
+        rgx = cffi_re2.compile(r'abc[d-f]+')
+        lo, hi = rgx.possible_match_range(10)
+        assert_true(lo <= b"abcd")
+        assert_true(b"abcfff" <= hi)
+        assert_true(lo.startswith(b"abc"))
+        assert_true(hi.startswith(b"abc"))
+
+    def test_possible_match_range_unbounded(self):
+        rgx = cffi_re2.compile(r'\C*abc')
+        assert_is_none(rgx.possible_match_range(10))
+
+    def test_required_prefix(self):
+        assert_equal(cffi_re2.compile(r'user:(\d+)').required_prefix(), b"user:")
+        assert_equal(cffi_re2.compile(r'(foo|bar)').required_prefix(), b"")
+        assert_equal(cffi_re2.compile(r'.*abc').required_prefix(), b"")
+        assert_equal(cffi_re2.compile(r'梦幻').required_prefix(), u'梦幻'.encode("utf-8"))
+
+class TestPosEndpos(object):
+    def test_search_pos(self):
+        rgx = cffi_re2.compile(r'b+')
+        mo = rgx.search('abbcabbb', 3)
+        assert_equal(mo.span(0), (5, 8))
+        assert_is_none(rgx.search('abbcabbb', 8))
+
+    def test_search_endpos(self):
+        rgx = cffi_re2.compile(r'b+')
+        assert_equal(rgx.search('abbcabbb', 0, 2).span(0), (1, 2))
+        assert_equal(rgx.search('abbcabbb', 4, 6).group(0), "b")
+        assert_is_none(rgx.search('abbcabbb', 3, 5))
+        assert_is_none(rgx.search('abbcabbb', 5, 4))
+
+    def test_match_pos(self):
+        rgx = cffi_re2.compile(r'b+')
+        assert_is_none(rgx.match('abbc'))
+        assert_equal(rgx.match('abbc', 1).group(0), "bb")
+        assert_equal(rgx.match('abbc', 1, 2).group(0), "b")
+
+    def test_findall_pos_endpos(self):
+        rgx = cffi_re2.compile(r'a(b+)')
+        assert_equal(rgx.findall("abbcdefabbbbcab", 1), ["bbbb", "b"])
+        assert_equal(rgx.findall("abbcdefabbbbcab", 0, 10), ["bb", "bb"])
+        assert_equal(rgx.findall("abbcdefabbbbcab", 20), [])
+
+    def test_finditer_unicode_pos(self):
+        rgx = cffi_re2.compile(r'b+')
+        spans = [mo.span(0) for mo in rgx.finditer(u'ääbbäbä', 3, 6, generateMO=True)]
+        assert_equal(spans, [(3, 4), (5, 6)])
+
+    def test_anchors(self):
+        # Same behaviour as re: the text ends at endpos, but does not start at pos
+        for p, args in [(r'b$', ('abc', 0, 2)), (r'^b', ('abc', 1)), (r'\bb', ('abc', 1)),
+                        (r'(?m)^b', ('a\nbc', 2)), (r'\Bb', ('abc', 1)), (r'c$', ('abc',))]:
+            expected = pyre.compile(p).search(*args)
+            actual = cffi_re2.compile(p).search(*args)
+            if expected is None:
+                assert_is_none(actual)
+            else:
+                assert_equal(actual.span(0), expected.span(0))
+        assert_is_none(cffi_re2.compile(r'^b').match('abc', 1))
+
+    def test_empty_matches_multibyte(self):
+        for p, text in [('', u'ää'), ('x*', u'äbä'), ('x*', u'梦幻a')]:
+            expected = [mo.span(0) for mo in pyre.finditer(p, text)]
+            actual = [mo.span(0) for mo in cffi_re2.compile(p).finditer(text, generateMO=True)]
+            assert_equal(actual, expected)
+        assert_equal(len(cffi_re2.compile('').findall(u'ää'.encode("utf-8"))), 5)
+
+    def test_bytes_byte_offsets(self):
+        rgx = cffi_re2.compile(r'b+')
+        data = u'äbbäb'.encode("utf-8")
+        mo = rgx.search(data, 3)
+        assert_equal(mo.span(0), (3, 4))
+        assert_equal(mo.group(0), b"b")
+        assert_equal(rgx.findall(data, 0, 4), [b"bb"])
+        assert_equal(rgx.findall(data, 3), [b"b", b"b"])
+
+    def test_window_cost_independent_of_pos(self):
+        import timeit
+        big = u'ä' * 2000000 + u'abbc' * 25
+        n = len(big)
+        rgx = cffi_re2.compile(r'ab+c')
+        early = min(timeit.repeat(lambda: rgx.search(big, 0, 100), number=20, repeat=5))
+        late = min(timeit.repeat(lambda: rgx.search(big, n - 100, n), number=20, repeat=5))
+        assert_equal(rgx.search(big, n - 100, n).span(0), (n - 100, n - 96))
+        assert_less(late, 10 * early + 0.001)
+
+    def test_span_at_end(self):
+        mo = cffi_re2.search(r'b+', u'äbb')
+        assert_equal(mo.span(0), (1, 3))
+
+class TestPreparedText(object):
+    def test_prepared_text(self):
+        text = cffi_re2.PreparedText(u'梦1幻2西3游 abbcabbb')
+        assert_equal(cffi_re2.compile(r'b+').search(text).span(0), (9, 11))
+        assert_equal(cffi_re2.compile(r'a(b+)').findall(text), ["bb", "bbb"])
+        assert_equal(cffi_re2.compile(r'a(b+)').findall(text, 10), ["bbb"])
+        assert_is_not_none(cffi_re2.compile(r'梦[^一-龥]*幻').match(text))
+        assert_equal(cffi_re2.compile(r'b+').search(text).group(0), "bb")
+
+    def test_prepared_text_pos_endpos(self):
+        text = cffi_re2.PreparedText(u'ääbbäbäb')
+        rgx = cffi_re2.compile(r'b+')
+        assert_equal(rgx.search(text, 3).span(0), (3, 4))
+        assert_equal(rgx.search(text, 4).span(0), (5, 6))
+        assert_is_none(rgx.search(text, 6, 7))
+        assert_equal(rgx.findall(text, 3, 7), ["b", "b"])
+        assert_is_not_none(cffi_re2.compile(r'b$').search(text, 0, 6))
+
+    def test_prepared_text_window_cost(self):
+        import timeit
+        text = cffi_re2.PreparedText(u'ä' * 2000000 + u'abbc' * 25)
+        n = len(text.string)
+        rgx = cffi_re2.compile(r'ab+c')
+        rgx.search(text, 0, 100)  # Build the tables
+        early = min(timeit.repeat(lambda: rgx.search(text, 0, 100), number=20, repeat=5))
+        late = min(timeit.repeat(lambda: rgx.search(text, n - 100, n), number=20, repeat=5))
+        assert_equal(rgx.search(text, n - 100, n).span(0), (n - 100, n - 96))
+        assert_less(late, 10 * early + 0.001)
+
+    def test_prepared_text_sub(self):
+        text = cffi_re2.PreparedText(u'pro----gram-files')
+        rgx = cffi_re2.compile(r'-{1,2}')
+        assert_equal(rgx.sub('x', text), 'proxxgramxfiles')
+        assert_equal(rgx.sub(lambda mo: '' if mo.group(0) == '-' else '-', text), 'pro--gramfiles')
+
+    def test_prepared_text_lazy_tables(self):
+        text = cffi_re2.PreparedText(u'ääbbäbäb')
+        assert_equal(cffi_re2.compile(r'b+').findall(text), ["bb", "b", "b"])
+        assert_is_none(text._offsets)
+
+    def test_prepared_text_latin1(self):
+        latin1 = cffi_re2.Options.ENCODING_LATIN1
+        text = cffi_re2.PreparedText(u'ääbbäbäb', latin1)
+        rgx = cffi_re2.compile(u'ä(b+)', options=cffi_re2.Options(encoding=latin1))
+        assert_equal([mo.span(1) for mo in rgx.finditer(text, 2, generateMO=True)],
+                     [(5, 6), (7, 8)])
+        assert_true(text._lut == cffi_re2.ffi.NULL)
+
+    @raises(ValueError)
+    def test_prepared_text_invalid_encoding(self):
+        cffi_re2.PreparedText(u'abc', 'utf8')
+
+    @raises(ValueError)
+    def test_prepared_text_encoding_mismatch(self):
+        text = cffi_re2.PreparedText(u'abc')
+        options = cffi_re2.Options(encoding=cffi_re2.Options.ENCODING_LATIN1)
+        cffi_re2.compile(r'b', options=options).search(text)
+
+class TestMatchBuffer(object):
+    def test_search_buffer(self):
+        buf = cffi_re2.MatchBuffer()
+        rgx = cffi_re2.compile(r'a(b+)')
+        mo1 = rgx.search("xabbc", buffer=buf)
+        mo2 = rgx.search("abbbb", buffer=buf)
+        assert_equal(mo1.group(1), "bb")
+        assert_equal(mo2.group(1), "bbbb")
+        assert_is_none(rgx.match("xab", buffer=buf))
+
+    def test_search_buffer_grows(self):
+        buf = cffi_re2.MatchBuffer(1)
+        mo = cffi_re2.compile(r'(a)(b)(c)').search("xabc", buffer=buf)
+        assert_equal(mo.groups(), ("a", "b", "c"))
+        assert_true(buf.size >= 4)
+
+    @raises(ValueError)
+    def test_buffer_size_zero(self):
+        cffi_re2.MatchBuffer(0)
+
+    def test_findall_buffer(self):
+        buf = cffi_re2.MatchBuffer(2)
+        rgx = cffi_re2.compile(r'(a)(b+)')
+        for _ in range(3):
+            assert_equal(rgx.findall("abbcdefabbbbca", buffer=buf), [("a", "bb"), ("a", "bbbb")])
+        spans = [mo.span(0) for mo in rgx.finditer(u"äabbab", generateMO=True, buffer=buf)]
+        assert_equal(spans, [(1, 4), (4, 6)])
+        assert_equal(rgx.findall("xyz", buffer=buf), [])
+
+    def test_scratch_steady_state(self):
+        # Repeated calls on a large text must not reallocate the scratch buffers
+        lib = cffi_re2._load_libre2()
+        big = u'ä' * 1000000 + u'abbc' * 25
+        n = len(big)
+        text = cffi_re2.PreparedText(big)
+        rgx = cffi_re2.compile(r'a(b+)c')
+        buf = cffi_re2.MatchBuffer(4)
+        def run():
+            assert_equal(rgx.search(big).span(0), (1000000, 1000004))
+            assert_equal(rgx.search(big, n - 10, n).span(1), (n - 7, n - 5))
+            assert_equal(len(rgx.findall(big)), 25)
+            assert_equal(len(rgx.findall(big, buffer=buf)), 25)
+            assert_equal(len(rgx.findall(text, buffer=buf)), 25)
+        run()
+        allocations = lib.GetScratchAllocations()
+        for _ in range(10):
+            run()
+        assert_equal(lib.GetScratchAllocations(), allocations)
+
+    def test_scratch_threads(self):
+        import threading
+        rgx = cffi_re2.compile(r'a(b+)')
+        errors = []
+        def worker(n):
+            s = u"ä" * n + "a" + "b" * n
+            for _ in range(20):
+                if rgx.findall(s) != ["b" * n] or rgx.search(s).span(1) != (n + 1, 2 * n + 1):
+                    errors.append(n)
+        threads = [threading.Thread(target=worker, args=(n,)) for n in (1, 10, 1000, 300000)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert_equal(errors, [])
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmark: importing cffi_re2 must stay cheap, i.e.
+it must not import cffi or load the native library until first use.
+"""
+import subprocess
+import sys
+if sys.version_info < (2, 7):
+    from nose_extra_tools import assert_equal, assert_less
+else:
+    from nose.tools import assert_equal, assert_less
+
+def run_python(code):
+    """Run code in a fresh interpreter and return its stripped stdout"""
+    return subprocess.check_output([sys.executable, "-c", code]).decode("utf-8").strip()
+
+def best_time(stmt, runs=5):
+    """Minimum wall-clock time (in seconds) of running stmt in a fresh interpreter"""
+    code = "import time; t = time.time(); {0}; print(time.time() - t)".format(stmt)
+    return min(float(run_python(code)) for _ in range(runs))
+
+class TestImport(object):
+    def test_import_is_lazy(self):
+        loaded = run_python(
+            "import sys, cffi_re2; "
+            "print(','.join(m for m in ('cffi', 'imp', 're', 'six', 'sre_compile') if m in sys.modules))")
+        assert_equal(loaded, "")
+
+    def test_loads_on_first_use(self):
+        out = run_python("import cffi_re2; print(cffi_re2.search(r'b+', 'abbc').group(0))")
+        assert_equal(out, "bb")
+
+    def test_import_time(self):
+        # Loading the native library (importing cffi, parsing the cdef
+        # and dlopen) must not be part of the import cost
+        import_time = best_time("import cffi_re2")
+        load_time = best_time("import cffi_re2; cffi_re2._load_libre2()")
+        assert_less(import_time, load_time / 2)